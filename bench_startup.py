@@ -0,0 +1,85 @@
+"""Startup benchmark for the entry points.
+
+Every entry point is imported in a fresh interpreter, as on a cold start, and then does its first piece of local work.
+Network calls (credentials, bucket lookups) are left out, so the numbers are import and cpu cost only.
+
+usage: python bench_startup.py [runs]
+"""
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+from statistics import median
+
+RUNS = 5
+HEAVY_MODULES = ['pandas', 'numpy', 'paramiko', 'google.cloud.bigquery', 'google.cloud.firestore',
+                 'google.cloud.storage']
+
+_PROBE = '''
+import json, sys, time
+t0 = time.perf_counter()
+{import_code}
+t1 = time.perf_counter()
+{work_code}
+t2 = time.perf_counter()
+print(json.dumps({{'import_sec': t1 - t0, 'first_work_sec': t2 - t0,
+                  'loaded': [m for m in {heavy} if m in sys.modules]}}))
+'''
+
+ENTRY_POINTS = {
+    'pharmacy_etl_example': (
+        'import pharmacy_etl_example as m',
+        '''
+from utils import load_csv_to_dataframe
+raw = {{'Serial__': 'Serial #', 'De_identified_Patient_ID': 'De-identified Patient ID'}}
+columns = [raw.get(c, c.replace('_', ' ')) for c in m.schema_rx_procare_append[:-2]]
+values = {{'De-identified Patient ID': '1', 'Rx Number': '2', 'Received Date': '2025-05-01',
+          'Dispense Date': '2025-05-02', 'Serial #': 'NI123', 'Total Fills': '1', 'Fills Dispensed': '1',
+          'Fill Remaining': '0', 'Provider NPI': '123', 'Provider Zip Code': '10001', 'Region': '1',
+          'Patient OOP': '$1.00', 'Copay': '$2.00', 'Date Written': '2025-04-30', 'NDC': '90017578200'}}
+csv = ','.join(columns) + '\\n' + ','.join(values.get(c, 'x') for c in columns) + '\\n'
+path = {tmp_csv!r}
+with open(path, 'w') as f:
+    f.write(csv)
+m.process_dataframe_rx_procare(load_csv_to_dataframe(path))
+'''),
+    'get_pharmacy_data_from_a_server': (
+        'import get_pharmacy_data_from_a_server as m',
+        '''
+import datetime
+m.file_exists_in_bucket = lambda bucket_name, file_name: False
+m.SFTPHandler(host='localhost', username='bench', remote_path='/', bucket='bench', password='bench')
+m.procare_file_filter('ProCare_THERANICA_ITD_DATAFEED_2025-05-05.csv', datetime.date.today(), 'bench')
+'''),
+}
+
+
+def run_probe(import_code: str, work_code: str) -> dict:
+    root = os.path.dirname(os.path.abspath(__file__))
+    tmp_dir = tempfile.mkdtemp(prefix='bench_startup_')
+    tmp_csv = os.path.join(tmp_dir, 'sample.csv')
+    code = _PROBE.format(import_code=import_code, work_code=work_code.format(tmp_csv=tmp_csv), heavy=HEAVY_MODULES)
+    try:
+        out = subprocess.run([sys.executable, '-c', code], cwd=root, capture_output=True, text=True, check=True)
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def main(runs: int = RUNS) -> None:
+    for name, (import_code, work_code) in ENTRY_POINTS.items():
+        try:
+            results = [run_probe(import_code, work_code) for _ in range(runs)]
+        except subprocess.CalledProcessError as e:
+            print(f'{name}: failed\n{e.stderr}')
+            continue
+        import_ms = median(r['import_sec'] for r in results) * 1000
+        first_work_ms = median(r['first_work_sec'] for r in results) * 1000
+        print(f'{name}: import {import_ms:.1f} ms, time to first work {first_work_ms:.1f} ms '
+              f'(median of {runs}), heavy modules loaded: {", ".join(results[0]["loaded"]) or "none"}')
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else RUNS)
@@ -1,10 +1,28 @@
+from __future__ import annotations
+
+import json
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
 from enum import Enum
-from typing import List, Optional
+from typing import List, Optional, Iterator, TYPE_CHECKING
 
-import pandas as pd
+from google.api_core.exceptions import GoogleAPICallError, GoogleAPIError, NotFound, ServerError, TooManyRequests
 from google.cloud import bigquery
+from requests.exceptions import RequestException
+
+if TYPE_CHECKING:
+    import pandas as pd  # only load_from_dataframe takes a dataframe, and it gets one from the caller
 
 BQ_USD_PER_TB = 5
+BQ_PAGE_SIZE = 10000
+# streaming insert limits are 50k rows and 10MB per request, 500 rows is the recommended request size
+BQ_INSERT_MAX_ROWS = 500
+BQ_INSERT_MAX_BYTES = 9 * 1024 * 1024
+BQ_INSERT_WORKERS = 8
+BQ_INSERT_RETRIES = 3
+BQ_INSERT_BACKOFF_SEC = 1
+BQ_INSERT_RETRIABLE_REASONS = {'stopped', 'backendError', 'internalError', 'timeout', 'rateLimitExceeded', 'requestError'}
 
 
 class Bigquery:
@@ -21,6 +39,7 @@ class Bigquery:
 
     def __init__(self) -> None:
         self._client = bigquery.Client()
+        self._tables = {}
 
     @staticmethod
     def _read_path(path: str) -> str:
@@ -47,6 +66,11 @@ class Bigquery:
         )
         return results_dict
 
+    def stream_query(self, sql: str, page_size: int = BQ_PAGE_SIZE) -> Iterator[dict]:
+        results = self._client.query(sql).result(page_size=page_size)
+        for row in results:
+            yield dict(row)
+
     def load_from_local(self, file_path: str, file_type, write_mode, table_path: str, conf=None) -> None:
         if conf is None:
             conf = {}
@@ -84,16 +108,85 @@ class Bigquery:
         table = self._client.get_table(table_path)
         print(f'loaded {table.num_rows} rows and {len(table.schema)} columns to {table_path}')
 
-    def insert_rows_json(self, records: List[dict], table_path: str) -> None:
-        table = self._client.get_table(table_path)
-        if table:
-            insert_response = self._client.insert_rows_json(json_rows=records, table=table_path)
-            if insert_response:
-                print(insert_response)
-            else:
-                print(f'{len(records)} rows inserted successfully to {table_path}')
-        else:
+    def _get_table(self, table_path: str) -> Optional[bigquery.Table]:
+        if table_path not in self._tables:
+            try:
+                self._tables[table_path] = self._client.get_table(table_path)
+            except NotFound:
+                return None
+        return self._tables[table_path]
+
+    @staticmethod
+    def _split_records(records: List[dict], max_rows: int, max_bytes: int) -> List[List[int]]:
+        chunks, chunk, chunk_bytes = [], [], 0
+        for i, record in enumerate(records):
+            record_bytes = len(json.dumps(record, default=str).encode('utf-8'))
+            if chunk and (len(chunk) == max_rows or chunk_bytes + record_bytes > max_bytes):
+                chunks.append(chunk)
+                chunk, chunk_bytes = [], 0
+            chunk.append(i)
+            chunk_bytes += record_bytes
+        if chunk:
+            chunks.append(chunk)
+        return chunks
+
+    def _insert_chunk(self, table: bigquery.Table, records: List[dict], row_ids: List[str],
+                      indexes: List[int]) -> List[dict]:
+        """Inserts one chunk, retrying only the rows that failed for transient reasons. Returns the failed rows."""
+        pending, failures = indexes, []
+        for attempt in range(BQ_INSERT_RETRIES + 1):
+            try:
+                errors = self._client.insert_rows_json(table, [records[i] for i in pending],
+                                                       row_ids=[row_ids[i] for i in pending])
+            except (GoogleAPIError, RequestException, ConnectionError) as e:
+                # 429/5xx, transport errors and an exhausted client retry deadline may pass on a later attempt,
+                # other api errors (bad request, forbidden..) won't
+                transient = not isinstance(e, GoogleAPICallError) or isinstance(e, (TooManyRequests, ServerError))
+                reason = 'requestError' if transient else 'requestFailed'
+                errors = [{'index': n, 'errors': [{'reason': reason, 'message': str(e)}]}
+                          for n in range(len(pending))]
+
+            retry = []
+            for error in errors:
+                index = pending[error['index']]
+                if attempt < BQ_INSERT_RETRIES and \
+                        all(e.get('reason') in BQ_INSERT_RETRIABLE_REASONS for e in error['errors']):
+                    retry.append(index)
+                else:
+                    failures.append({'index': index, 'errors': error['errors']})
+
+            if not retry:
+                break
+            pending = retry
+            time.sleep(BQ_INSERT_BACKOFF_SEC * 2 ** attempt)
+        return failures
+
+    def insert_rows_json(self, records: List[dict], table_path: str, max_rows: int = BQ_INSERT_MAX_ROWS,
+                         max_bytes: int = BQ_INSERT_MAX_BYTES, max_workers: int = BQ_INSERT_WORKERS) -> dict:
+        """Streams records to table_path in size-bounded chunks, sent concurrently.
+
+        Returns {'inserted': <row count>, 'failed': [{'index': <position in records>, 'errors': [...]}]}.
+        """
+        table = self._get_table(table_path)
+        if not table:
             print(f'table {table_path} was not found')
+            return {'inserted': 0, 'failed': [{'index': i, 'errors': [{'reason': 'notFound'}]}
+                                              for i in range(len(records))]}
+
+        # fixed row ids let bigquery de-duplicate rows that are sent again on retry
+        row_ids = [str(uuid.uuid4()) for _ in records]
+        chunks = self._split_records(records, max_rows, max_bytes)
+        with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(chunks)))) as executor:
+            results = executor.map(lambda c: self._insert_chunk(table, records, row_ids, c), chunks)
+            failures = sorted([f for chunk_failures in results for f in chunk_failures], key=lambda f: f['index'])
+
+        report = {'inserted': len(records) - len(failures), 'failed': failures}
+        if failures:
+            print(f'{report["inserted"]} rows inserted to {table_path}, {len(failures)} rows failed: '
+                  f'{failures[:10]}')
+        else:
+            print(f'{len(records)} rows inserted successfully to {table_path}')
+        return report
 
     def verify_table(self, table_path: str, schema: List[bigquery.SchemaField],
                      partitioning_type: Optional[str] = 'date', clustering_fields=Optional[None]) -> None:
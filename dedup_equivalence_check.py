@@ -0,0 +1,112 @@
+"""Checks that the pandas pre-dedup of pharmacy_etl_example matches steps 1-3 of pharmacy_etl.sql.
+
+The sql steps are run on sqlite against the same rows, after a csv round trip like the one the load to bigquery makes.
+Without a file argument a generated sample with duplicates, missing serials/dates and filtered statuses is used.
+
+usage: python dedup_equivalence_check.py [raw procare csv]
+"""
+import io
+import sqlite3
+import sys
+
+import pandas as pd
+
+from pharmacy_etl_example import process_dataframe_rx_procare, dedup_rx_procare, RX_PROCARE_EXCLUDED_KEY, \
+    RX_PROCARE_SCRIPT_STATUSES
+from utils import load_csv_to_dataframe
+
+# pharmacy_etl.sql steps 1-3 in sqlite. || is null when any operand is, like bigquery's concat
+SQL_STEPS = f'''
+create temp table rx_procare_base as
+select distinct
+   *,
+   coalesce(Serial__, 'Unknown') as Serial_coalesce,
+   coalesce(Dispense_Date, '1000-01-01') as Dispense_Date_coalesce
+from rx_procare_append
+where De_identified_Patient_ID || '-' || Rx_Number || '-' || coalesce(Serial__, 'Unknown') || '-' ||
+      coalesce(Dispense_Date, '1000-01-01') != '{RX_PROCARE_EXCLUDED_KEY}'
+and Script_Status in ({', '.join(f"'{s}'" for s in RX_PROCARE_SCRIPT_STATUSES)});
+
+create temp table rx_procare_ranked as
+select *,
+  count(*) over (
+    partition by De_identified_Patient_ID || '-' || Rx_Number || '-' || Serial_coalesce || '-' || Dispense_Date_coalesce
+  ) as dup_count,
+  row_number() over (
+    partition by De_identified_Patient_ID || '-' || Rx_Number || '-' || Serial_coalesce || '-' || Dispense_Date_coalesce
+    order by Dispense_Date desc
+  ) as rn
+from rx_procare_base;
+
+create temp table rx_procare_temp as
+select * from rx_procare_ranked where rn = 1;
+'''
+KEY_COLUMNS = ['De_identified_Patient_ID', 'Rx_Number', 'Serial_coalesce', 'Dispense_Date_coalesce']
+
+
+def sample_raw_rx_procare() -> pd.DataFrame:
+    from pharmacy_etl_example import schema_rx_procare_append
+
+    raw_names = {'De_identified_Patient_ID': 'De-identified Patient ID', 'Serial__': 'Serial #'}
+    columns = [raw_names.get(c, c.replace('_', ' ')) for c in schema_rx_procare_append[:-2]]
+    patient, rx = RX_PROCARE_EXCLUDED_KEY.split('-')[:2]
+    rows = [
+        # patient, rx, serial, dispense date, status, copay
+        ('1', '10', 'NI100', '2025-05-01', 'OPEN', '$1.00'),
+        ('1', '10', 'NI100', '2025-05-01', 'OPEN', '$1.00'),     # exact duplicate, removed by distinct
+        ('1', '10', 'NI100', '2025-05-01', 'SHIPPED', '$2.00'),  # same key, different row
+        ('1', '11', '', '', 'CLOSED', '$0.00'),
+        ('1', '11', '', '', 'TRANSFERRED', '$3.00'),
+        ('1', '11', '   ', '', 'OPEN', '$4.00'),               # blank serial, null once loaded
+        ('2', '20', 'NM200', '2025-05-02', 'CANCELLED', '$1.00'),
+        ('2', '21', 'NM201', '', 'OPEN', '$1.00'),
+        ('', '22', 'NM202', '2025-05-03', 'OPEN', '$1.00'),      # null patient, null key in sql
+        (patient, rx, '', '', 'OPEN', '$1.00'),                  # the excluded key
+        ('3', '30', 'DL2432570', '2025-05-04', 'SHIPPED', '$5.00'),
+        ('3', '30', 'DL2432570', '2025-05-04', '', '$5.00'),
+        ('A4', '40', 'NI400', '2025-05-05', 'OPEN', '$1.00'),
+        (' A4', '40', 'NI400', '2025-05-05', 'OPEN', '$1.00'),   # bigquery doesn't trim, a different patient
+    ]
+    lines = [','.join(columns)]
+    for p, r, serial, dispense_date, status, copay in rows:
+        values = {'De-identified Patient ID': p, 'Rx Number': r, 'Serial #': serial, 'Dispense Date': dispense_date,
+                  'Script Status': status, 'Copay': f'"{copay}"', 'Patient OOP': '"$0.00"', 'Region': '1',
+                  'Received Date': '2025-04-30', 'Date Written': '2025-04-29', 'NDC': '90017578200',
+                  'Total Fills': '1', 'Fills Dispensed': '1', 'Fill Remaining': '0', 'Provider NPI': '123',
+                  'Provider Zip Code': '10001'}
+        lines.append(','.join(values.get(c, 'x') for c in columns))
+    return pd.read_csv(io.StringIO('\n'.join(lines) + '\n')).dropna(how='all')
+
+
+def csv_round_trip(df: pd.DataFrame) -> pd.DataFrame:
+    # convert_dtypes writes ids that got a float dtype from gaps as integers, which is how the dedup key formats them
+    return pd.read_csv(io.StringIO(df.convert_dtypes().to_csv(index=False)), dtype=str)
+
+
+def check(raw: pd.DataFrame) -> bool:
+    processed = process_dataframe_rx_procare(raw.copy())
+    deduped = csv_round_trip(dedup_rx_procare(processed))
+
+    with sqlite3.connect(':memory:') as conn:
+        csv_round_trip(processed).to_sql('rx_procare_append', conn, index=False)
+        conn.executescript(SQL_STEPS)
+        base = pd.read_sql('select * from rx_procare_base', conn).drop(columns=KEY_COLUMNS[2:])
+        expected = pd.read_sql('select * from rx_procare_temp', conn)
+
+    deduped['Serial_coalesce'] = deduped['Serial__'].fillna('Unknown')
+    deduped['Dispense_Date_coalesce'] = deduped['Dispense_Date'].fillna('1000-01-01')
+    counts = sorted(map(tuple, deduped[KEY_COLUMNS + ['dup_count']].astype(str).values))
+    expected_counts = sorted(map(tuple, expected[KEY_COLUMNS + ['dup_count']].astype(str).values))
+    # rn = 1 is picked among rows that tie on dispense date, so rows are only required to be one of the candidates
+    candidates = set(map(tuple, base.astype(str).values))
+    rows = set(map(tuple, deduped[list(base.columns)].astype(str).values))
+
+    print(f'{len(raw)} raw rows, {len(expected)} rows after sql dedup, {len(deduped)} rows after pandas dedup')
+    ok = counts == expected_counts and rows <= candidates
+    print('pandas dedup matches pharmacy_etl.sql steps 1-3' if ok else 'pandas dedup differs from pharmacy_etl.sql')
+    return ok
+
+
+if __name__ == '__main__':
+    source = load_csv_to_dataframe(sys.argv[1]) if len(sys.argv) > 1 else sample_raw_rx_procare()
+    sys.exit(0 if check(source) else 1)
@@ -1,12 +1,24 @@
+import json
 from collections import namedtuple
-from typing import List, Any
+from enum import Enum
+from typing import List, Any, Tuple, Iterator, Optional
+from google.api_core.exceptions import GoogleAPICallError
 from google.cloud import firestore
 
 FS_BATCH_SIZE = 500
+FS_PAGE_SIZE = 1000
+# where ops the client doesn't add an order by the filtered field for when paging with a cursor
+FS_UNORDERED_OPS = ('==', 'array_contains')
 UpdateScope = namedtuple('UpdateScope', ['key', 'field', 'values'])
 
 
 class Firestore:
+    class ArrayOp(Enum):
+        ADD = 'add'
+        REMOVE = 'remove'
+        ARCHIVE = 'archive'
+        UNARCHIVE = 'unarchive'
+
     def __init__(self, project_id: str, verbose: bool = False) -> None:
         # noinspection PyTypeChecker
         self._db = firestore.Client(project_id)
@@ -30,6 +42,25 @@ class Firestore:
             batch.commit()
             print(f'{rec_count} record(s) committed to firestore..')
 
+    def upsert(self, collection_id: str, docs: List[dict], existing_keys: set) -> None:
+        """Like update, but the caller already knows which keys exist so no document is read before writing."""
+        batch = self._db.batch()
+        batch_count = 0
+
+        for doc in docs:
+            doc_ref = self._db.collection(collection_id).document(doc['key'])
+            batch.update(doc_ref, doc['payload']) if doc['key'] in existing_keys else batch.set(doc_ref, doc['payload'])
+            batch_count += 1
+            if batch_count == FS_BATCH_SIZE:
+                batch.commit()
+                print(f'{batch_count} records committed to firestore.. ({collection_id})')
+                batch = self._db.batch()
+                batch_count = 0
+
+        if batch_count:
+            batch.commit()
+            print(f'{batch_count} record(s) committed to firestore.. ({collection_id})')
+
     def update_array_add(self, collection_id: str, doc: dict) -> None:
         update_scope = UpdateScope(doc['key'], doc['payload']['field'], doc['payload']['values'])
         doc_ref = self._db.collection(collection_id).document(update_scope.key)
@@ -57,6 +88,107 @@ class Firestore:
         doc_ref.update({update_scope.field: firestore.ArrayRemove(list(set(update_scope.values)))})
         print(f'{update_scope.values} removed from field {update_scope.field} ({update_scope.key})')
 
+    @staticmethod
+    def _array_value_key(value: Any) -> Any:
+        # dict values (e.g. update_array_add with a dict payload) are not hashable. scalars are keyed with their type
+        # since firestore tells 1, 1.0 and True apart while python equality doesn't
+        if isinstance(value, (dict, list)):
+            return 'json', json.dumps(value, sort_keys=True, default=str)
+        return type(value), value
+
+    @classmethod
+    def _coalesce_array_updates(cls, updates: List[Tuple['Firestore.ArrayOp', dict]]) -> dict:
+        """Returns the net effect of the updates as {key: {field: (values_to_add, values_to_remove)}}."""
+        state = {}  # (key, field) -> {value_key: [is_add, seq, value, removed]}
+        seq = 0
+        for op, doc in updates:
+            update_scope = UpdateScope(doc['key'], doc['payload']['field'], doc['payload']['values'])
+            field = update_scope.field + '_archive' if op in (cls.ArrayOp.ARCHIVE, cls.ArrayOp.UNARCHIVE) \
+                else update_scope.field
+            is_add = op in (cls.ArrayOp.ADD, cls.ArrayOp.ARCHIVE)
+            values = update_scope.values if isinstance(update_scope.values, list) else [update_scope.values]
+
+            field_state = state.setdefault((update_scope.key, field), {})
+            for value in values:
+                value_key = cls._array_value_key(value)
+                current = field_state.get(value_key)
+                if is_add and current is not None and current[0]:
+                    continue  # already added since the last remove, ArrayUnion would be a no-op
+                # a value added back after a remove goes to both lists: removing it before the union moves it
+                # to the end of the array, as the sequential calls would
+                removed = not is_add or (current is not None and current[3])
+                field_state[value_key] = [is_add, seq, value, removed]
+                seq += 1
+
+        coalesced = {}
+        for (key, field), field_state in state.items():
+            ordered = sorted(field_state.values(), key=lambda v: v[1])
+            to_add = [v[2] for v in ordered if v[0]]
+            to_remove = [v[2] for v in ordered if v[3]]
+            coalesced.setdefault(key, {})[field] = (to_add, to_remove)
+        return coalesced
+
+    def _commit_array_writes(self, collection_id: str, entries: List[Tuple[str, List[dict]]]) -> List[str]:
+        """Commits the writes in one batch, falling back to one commit per document. Returns the failed keys."""
+        batch = self._db.batch()
+        for key, writes in entries:
+            doc_ref = self._db.collection(collection_id).document(key)
+            for w in writes:
+                batch.update(doc_ref, w)
+        try:
+            batch.commit()
+            print(f'{sum(len(w) for _, w in entries)} writes committed to firestore..')
+            return []
+        except GoogleAPICallError as e:
+            print(f'batch commit failed ({e}), committing {len(entries)} records one by one..')
+
+        failed = []
+        for key, writes in entries:
+            batch = self._db.batch()
+            doc_ref = self._db.collection(collection_id).document(key)
+            for w in writes:
+                batch.update(doc_ref, w)
+            try:
+                batch.commit()
+            except GoogleAPICallError as e:
+                print(f'array updates failed for {key} ({collection_id}): {e}')
+                failed.append(key)
+        return failed
+
+    def update_array_bulk(self, collection_id: str, updates: List[Tuple['Firestore.ArrayOp', dict]]) -> List[str]:
+        """Applies (ArrayOp, doc) updates with one write per document. Returns the keys that failed."""
+        coalesced = self._coalesce_array_updates(updates)
+        print(f'about to apply {len(updates)} array updates to {len(coalesced)} records in firestore.. ({collection_id})')
+        entries, batch_count, failed = [], 0, []
+
+        for key, fields in coalesced.items():
+            # firestore allows one transform per field in a write, so a field that gains and loses values needs two
+            writes = [{}, {}]
+            for field, (to_add, to_remove) in fields.items():
+                if to_add and to_remove:
+                    writes[0][field] = firestore.ArrayRemove(to_remove)
+                    writes[1][field] = firestore.ArrayUnion(to_add)
+                elif to_add:
+                    writes[0][field] = firestore.ArrayUnion(to_add)
+                elif to_remove:
+                    writes[0][field] = firestore.ArrayRemove(to_remove)
+            writes = [w for w in writes if w]
+            if not writes:
+                continue
+
+            if batch_count + len(writes) > FS_BATCH_SIZE:
+                failed += self._commit_array_writes(collection_id, entries)
+                entries, batch_count = [], 0
+            entries.append((key, writes))
+            batch_count += len(writes)
+
+        if entries:
+            failed += self._commit_array_writes(collection_id, entries)
+        rec_count = sum(1 for fields in coalesced.values() if any(a or r for a, r in fields.values())) - len(failed)
+        print(f'{len(updates)} array updates applied to {rec_count} record(s) ({collection_id})'
+              + (f', {len(failed)} record(s) failed: {failed}' if failed else ''))
+        return failed
+
     def read_docs(self, collection_id: str, doc_ids: List[str]) -> List[dict]:
         docs = []
         if len(doc_ids):
@@ -67,6 +199,12 @@ class Firestore:
             return docs
         return [doc.to_dict() for doc in self._db.collection(collection_id).stream()]     # all documents in collection
 
+    def read_docs_fields(self, collection_id: str, doc_ids: List[str], fields: List[str]) -> dict:
+        """Fetches only the given fields of many documents in one round trip. Missing documents are left out."""
+        doc_refs = [self._db.collection(collection_id).document(doc_id) for doc_id in doc_ids]
+        snapshots = self._db.get_all(doc_refs, field_paths=fields) if doc_refs else []
+        return {snapshot.id: snapshot.to_dict() or {} for snapshot in snapshots if snapshot.exists}
+
     def read_docs_by_field(self, collection_id: str, field_id: str) -> List[dict]:
         docs = self._db.collection(collection_id).order_by(field_id).get()
         return [doc.to_dict() for doc in docs] if len(docs) else []
@@ -74,3 +212,52 @@ class Firestore:
     def read_docs_by_where(self, collection_id: str, field_path: str, op_string: str, value: Any) -> List[dict]:
         docs = self._db.collection(collection_id).where(field_path, op_string, value).get()
         return [doc.to_dict() for doc in docs] if len(docs) else []
+
+    @staticmethod
+    def _stream_query(query, page_size: int, limit: Optional[int], fields: Optional[List[str]],
+                      cursor_fields: List[str]) -> Iterator[dict]:
+        """Pages through a query with start_after cursors, holding a single page in memory at a time."""
+        strip = None
+        if fields is not None:
+            # fields the cursor orders by must be projected too, otherwise start_after can't use the snapshot
+            extra = [f for f in cursor_fields if f not in fields]
+            query = query.select(list(fields) + extra)
+            strip = {f.split('.')[0] for f in fields} if extra else None
+
+        yielded, last = 0, None
+        while True:
+            page_limit = page_size if limit is None else min(page_size, limit - yielded)
+            if page_limit <= 0:
+                return
+            page = query.limit(page_limit)
+            if last is not None:
+                page = page.start_after(last)
+            snapshots = list(page.stream())
+            for snapshot in snapshots:
+                doc = snapshot.to_dict()
+                yield {k: v for k, v in doc.items() if k in strip} if strip else doc
+            yielded += len(snapshots)
+            if len(snapshots) < page_limit:
+                return
+            last = snapshots[-1]
+
+    def stream_docs(self, collection_id: str, page_size: int = FS_PAGE_SIZE, fields: Optional[List[str]] = None,
+                    limit: Optional[int] = None) -> Iterator[dict]:
+        query = self._db.collection(collection_id).order_by('__name__')
+        return self._stream_query(query, page_size, limit, fields, [])
+
+    def stream_docs_by_field(self, collection_id: str, field_id: str, page_size: int = FS_PAGE_SIZE,
+                             fields: Optional[List[str]] = None, limit: Optional[int] = None) -> Iterator[dict]:
+        query = self._db.collection(collection_id).order_by(field_id)
+        return self._stream_query(query, page_size, limit, fields, [field_id])
+
+    def stream_docs_by_where(self, collection_id: str, field_path: str, op_string: str, value: Any,
+                             page_size: int = FS_PAGE_SIZE, fields: Optional[List[str]] = None,
+                             limit: Optional[int] = None) -> Iterator[dict]:
+        query = self._db.collection(collection_id).where(field_path, op_string, value)
+        cursor_fields = []
+        if op_string not in FS_UNORDERED_OPS:
+            # the client orders by field_path once a cursor is set, so every page has to be ordered that way
+            query = query.order_by(field_path)
+            cursor_fields = [field_path]
+        return self._stream_query(query, page_size, limit, fields, cursor_fields)
@@ -1,12 +1,12 @@
 import os
 import re
-from datetime import datetime, timedelta
-from utils import RequestMock, get_config, get_default_credentials, load_csv_to_dataframe, load_excel_to_dataframe, get_local_path
-from firestore import Firestore
+from datetime import datetime
+from functools import lru_cache
+from utils import get_config, get_default_credentials
 from sftp import SFTPHandler
-from google.cloud import storage
 
-credentials, project = get_default_credentials()
+# credentials and the storage client are created on the first run rather than at import time, to keep cold starts
+# short. this module never needs pandas, so nothing here should pull it in
 
 FS_COLLECTION_CONFIGS = 'configs_jobs'
 FS_DOCUMENT_CONFIG_ID = 'job-data-fetcher-procare'
@@ -53,14 +53,19 @@ def procare_file_filter(filename: str, file_date: datetime.date, bucket_name: st
     return False
 
 
+@lru_cache(maxsize=None)
+def get_storage_client():
+    from google.cloud import storage
+    return storage.Client()
+
+
 def file_exists_in_bucket(bucket_name: str, file_name: str) -> bool:
-    client = storage.Client()
-    bucket = client.bucket(bucket_name)
+    bucket = get_storage_client().bucket(bucket_name)
     return bucket.blob(file_name).exists()
 
 
 def run(event=None, context=None):
-    fs = Firestore(project)
+    _, project = get_default_credentials()
     config = get_config(project, FS_COLLECTION_CONFIGS, FS_DOCUMENT_CONFIG_ID)
 
     # extract multiple fs fields
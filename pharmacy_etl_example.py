@@ -1,17 +1,21 @@
-import numpy as np
-import pandas as pd
-import re
+from __future__ import annotations
+
 from os import path
 from datetime import datetime
-from bigquery import Bigquery
-from storage import Storage
+from typing import TYPE_CHECKING
 from utils import RequestMock, get_config, get_default_credentials, load_csv_to_dataframe, load_excel_to_dataframe
 
-credentials, project = get_default_credentials()
+# pandas, numpy and the google clients are imported in the code paths that use them, and credentials are
+# resolved on the first run, to keep cold starts short
+if TYPE_CHECKING:
+    import pandas as pd
 
 FS_COLLECTION_CONFIGS = 'configs_services'
 FS_DOCUMENT_CONFIG_ID = 'srv-data-listener-procare'
 SQL_SCRIPT_LOCATION = 'sql'
+# pharmacy_etl.sql steps 1-3 keep only these statuses and drop this key
+RX_PROCARE_SCRIPT_STATUSES = ['OPEN', 'CLOSED', 'TRANSFERRED', 'SHIPPED']
+RX_PROCARE_EXCLUDED_KEY = '1466866-4470639-Unknown-1000-01-01'
 
 schema_rx_procare_append = [
     "De_identified_Patient_ID", "Rx_Number", "Received_Date", "Dispense_Date", "Serial__", "Total_Fills",
@@ -32,15 +36,45 @@ schema_bi_summary = [
 ]
 
 
-def clean_serial(sn: str) -> str:
-    if pd.isna(sn):
-        return sn
-    sn = str(sn).strip()
-    match = re.search(r'(NM|NI)[\w-]+', sn)
-    return match.group(0) if match else sn
+def clean_serials(serials: pd.Series) -> pd.Series:
+    stripped = serials.astype(str).str.strip()
+    cleaned = stripped.str.extract(r'((?:NM|NI)[\w-]+)', expand=False).fillna(stripped)
+    return cleaned.where(serials.notna(), serials)
+
+
+def rx_procare_dedup_key(df: pd.DataFrame) -> pd.Series:
+    """The partition key of pharmacy_etl.sql, null when any part is null as with bigquery's concat."""
+    import pandas as pd
+
+    def as_str(s: pd.Series) -> pd.Series:
+        # ids get a float dtype when the column has gaps, format them as the integers they are
+        if pd.api.types.is_float_dtype(s):
+            return s.astype('Int64').astype(str).where(s.notna())
+        s = s.astype(str).where(s.notna())
+        return s.where(s != '')  # empty strings are loaded to bigquery as null, other strings aren't trimmed
+
+    dispense_date = pd.to_datetime(df['Dispense_Date']).dt.strftime('%Y-%m-%d').fillna('1000-01-01')
+    # serials were stripped by clean_serials, so blank ones are empty here and null in bigquery
+    serial = as_str(df['Serial__']).fillna('Unknown')
+    return as_str(df['De_identified_Patient_ID']) + '-' + as_str(df['Rx_Number']) + '-' + serial + '-' + dispense_date
 
 
-def process_dataframe_rx_procare(df: pd.DataFrame) -> pd.DataFrame:
+def dedup_rx_procare(df: pd.DataFrame) -> pd.DataFrame:
+    """Steps 1-3 of pharmacy_etl.sql (distinct, status filter, rn = 1 per key) with dup_count attached."""
+    # empty strings (e.g. serials clean_serials stripped to '') are loaded to bigquery as null, treat them so for distinct
+    df = df.replace('', float('nan')).drop_duplicates()
+    key = rx_procare_dedup_key(df)
+    df = df[key.notna() & (key != RX_PROCARE_EXCLUDED_KEY) & df['Script_Status'].isin(RX_PROCARE_SCRIPT_STATUSES)]
+    key = key.loc[df.index]
+    # within a key the dispense dates are equal, so the sql's order by dispense_date desc leaves any row as rn = 1
+    df = df.assign(dup_count=key.groupby(key).transform('size'))
+    return df[~key.duplicated()]
+
+
+def process_dataframe_rx_procare(df: pd.DataFrame, dedup: bool = False) -> pd.DataFrame:
+    import numpy as np
+    import pandas as pd
+
     def convert_to_int(value, default):
         try:
             return int(value)
@@ -63,7 +97,7 @@ def process_dataframe_rx_procare(df: pd.DataFrame) -> pd.DataFrame:
     df['Received Date'] = pd.to_datetime(df['Received Date']).dt.date
     df['Dispense Date'] = pd.to_datetime(df['Dispense Date']).dt.date
     df['Date Written'] = pd.to_datetime(df['Date Written']).dt.date
-    df['Serial #'] = df['Serial #'].apply(clean_serial)
+    df['Serial #'] = clean_serials(df['Serial #'])
     df['modified_serial_id'] = df['Serial #']
     # df.rename(columns={'De-identified Patient ID': 'De_identified_Patient_ID', 'Serial #': 'Serial__'}, inplace=True)
     grouped = df.groupby('De-identified Patient ID')
@@ -92,10 +126,14 @@ def process_dataframe_rx_procare(df: pd.DataFrame) -> pd.DataFrame:
 
     df['_snapshot_date'] = datetime.today().strftime("%Y-%m-%d")
     df.columns = schema_rx_procare_append
+    if dedup:
+        df = dedup_rx_procare(df)
     return df
 
 
 def process_dataframe_bi_summary(df: pd.DataFrame) -> pd.DataFrame:
+    import pandas as pd
+
     df.columns = df.columns.str.replace('_ ', '_').str.replace(' ', '_').str.replace('/', '_').str.replace('-', '_').str.replace(' _', '_')
     column_rename = {'CLAIM_PAYMENT': 'MED_CLAIM_PAYMENT', 'APPLIED_DEDUCTIBLE': 'MED_APPLIED_DEDUCTIBLE', 'PAT_COPAY_COINS': 'MED_PAT_COPAY_CO_INS'}
     df.rename(columns=column_rename, inplace=True)
@@ -124,15 +162,19 @@ def is_local_run() -> bool:
 def run(event, context):
     filename, bucket = event['name'], event['bucket']
     print(f'{filename} from bucket {bucket} has triggered a function run..')
+    _, project = get_default_credentials()
     config = get_config(project, FS_COLLECTION_CONFIGS, FS_DOCUMENT_CONFIG_ID)
 
     if 'PROCARE_THERANICA_ITD_DATAFEED' in filename.upper():
+        from bigquery import Bigquery
+        from storage import Storage
         bq = Bigquery()
 
         table_path = '.'.join([config['rx_procare']['bigquery_dataset'], config['rx_procare']['bigquery_tableid']])
         local_path = Storage().download_blob(bucket, filename)
         df = load_csv_to_dataframe(local_path)
-        df = process_dataframe_rx_procare(df)
+        # the append table and rx_procare.sql must expect dup_count before pre_dedup is switched on
+        df = process_dataframe_rx_procare(df, dedup=config['rx_procare'].get('pre_dedup', False))
         df.to_csv(local_path, index=False)
         bq.load_from_local(local_path, bq.FileType.CSV, bq.WriteMode.APPEND, table_path,
                            {Bigquery.LoadJobConfig.SKIP_LEADING_ROWS: 1})
@@ -143,6 +185,8 @@ def run(event, context):
         bq.run_append_script('select * from staging.rx_procare_tmp;', '.'.join([project, 'dwh', 'rx_pharmacies']))
         bq.run_dml_script_from_path(path.join(SQL_SCRIPT_LOCATION, 'procare_mock_remove.sql'))
     elif 'BI SUMMARY' in filename.upper():
+        from bigquery import Bigquery
+        from storage import Storage
         bq = Bigquery()
 
         table_path = '.'.join([config['bi_summary']['bigquery_dataset'], config['bi_summary']['bigquery_tableid']])
@@ -164,6 +208,8 @@ def run(event, context):
 
 # FOR LOCAL TESTING ############################################################################################
 if __name__ == '__main__':
+    import pandas as pd
+
     # pandas settings
     pd.options.display.max_columns = None
     pd.options.display.max_rows = None
@@ -1,5 +1,4 @@
 import os
-import paramiko
 from datetime import datetime, timedelta
 from utils import get_local_path
 from storage import Storage
@@ -24,6 +23,7 @@ class SFTPHandler:
         self.transport = None
 
     def connect(self):
+        import paramiko  # only needed once a connection is made
         print("Connecting to SFTP server...")
         self.transport = paramiko.Transport((self.host, SFTP_PORT))
         self.transport.banner_timeout = TIMEOUT  # increase timeout
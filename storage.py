@@ -1,10 +1,10 @@
 import os
-from google.cloud import storage
 from utils import get_local_path
 
 
 class Storage:
     def __init__(self) -> None:
+        from google.cloud import storage
         self._storage = storage.Client()
 
     def download_blob(self, bucket_name: str, source_blob_name: str, target_path: str = None) -> str:
@@ -0,0 +1,66 @@
+import hashlib
+import json
+from itertools import islice
+from typing import Iterable, Iterator, List, Optional
+
+from bigquery import Bigquery
+from firestore import Firestore, FS_BATCH_SIZE
+
+FS_FIELD_CONTENT_HASH = '_content_hash'
+
+
+def content_hash(record: dict) -> str:
+    payload = {k: v for k, v in record.items() if k != FS_FIELD_CONTENT_HASH}
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+
+def _chunks(records: Iterable[dict], size: int) -> Iterator[List[dict]]:
+    it = iter(records)
+    while chunk := list(islice(it, size)):
+        yield chunk
+
+
+def sync_records_to_firestore(fs: Firestore, records: Iterable[dict], collection_id: str, doc_id_field: str,
+                              manifest_collection_id: Optional[str] = None, chunk_size: int = FS_BATCH_SIZE) -> dict:
+    """Writes only the records whose content changed since the last sync.
+
+    The hash of every written record is stored in the target document itself, or in a document with the same id
+    in manifest_collection_id when given, and compared against on the next run. Records are processed in chunks
+    so that memory use doesn't grow with the size of the result set.
+    """
+    hash_collection_id = manifest_collection_id or collection_id
+    counts = {'inserted': 0, 'updated': 0, 'unchanged': 0}
+
+    for chunk in _chunks(records, chunk_size):
+        keyed = {str(r[doc_id_field]): r for r in chunk}  # last record wins on duplicate ids, as in sequential writes
+        stored = fs.read_docs_fields(hash_collection_id, list(keyed.keys()), [FS_FIELD_CONTENT_HASH])
+        existing = set(stored.keys()) if manifest_collection_id is None \
+            else set(fs.read_docs_fields(collection_id, list(keyed.keys()), [doc_id_field]).keys())
+
+        docs, hashes = [], []
+        for key, record in keyed.items():
+            h = content_hash(record)
+            if stored.get(key, {}).get(FS_FIELD_CONTENT_HASH) == h:
+                counts['unchanged'] += 1
+                continue
+            counts['updated' if key in existing else 'inserted'] += 1
+            if manifest_collection_id is None:
+                docs.append({'key': key, 'payload': {**record, FS_FIELD_CONTENT_HASH: h}})
+            else:
+                docs.append({'key': key, 'payload': record})
+                hashes.append({'key': key, 'payload': {FS_FIELD_CONTENT_HASH: h}})
+
+        if docs:
+            fs.upsert(collection_id, docs, existing)
+        if hashes:
+            # the manifest is written after the target, so a failed run is re-synced rather than skipped
+            fs.upsert(manifest_collection_id, hashes, set(stored.keys()))
+
+    print(f'sync to {collection_id} completed: {counts["inserted"]} inserted, {counts["updated"]} updated, '
+          f'{counts["unchanged"]} unchanged')
+    return counts
+
+
+def sync_query_to_firestore(bq: Bigquery, fs: Firestore, sql: str, collection_id: str, doc_id_field: str,
+                            manifest_collection_id: Optional[str] = None) -> dict:
+    return sync_records_to_firestore(fs, bq.stream_query(sql), collection_id, doc_id_field, manifest_collection_id)
@@ -1,23 +1,29 @@
+from __future__ import annotations
+
 import os
 import json
 import tempfile
 import time
-import pandas as pd
-import google.auth
-from google.cloud import firestore
-from typing import List, Any
+from functools import lru_cache
+from typing import List, Any, TYPE_CHECKING
 
-from core.firestore import Firestore
+# pandas and the google clients are imported where they're used, so entry points that don't need them
+# (e.g. the sftp ingester never touches pandas) don't pay for them on cold start
+if TYPE_CHECKING:
+    import pandas as pd
+    from firestore import Firestore
 
 FS_COLLECTION_USERS = 'app_users'
 
 
 def load_csv_to_dataframe(filepath: str) -> pd.DataFrame:
+    import pandas as pd
     df = pd.read_csv(filepath).dropna(how='all')
     return df
 
 
 def load_excel_to_dataframe(filepath: str, sheet_name: Any = 0, header: Any = 0) -> pd.DataFrame:
+    import pandas as pd
     with (pd.ExcelFile(filepath) as xls):
         if (isinstance(sheet_name, str) and sheet_name in xls.sheet_names) or \
                 (isinstance(sheet_name, int) and sheet_name < len(xls.sheet_names)):
@@ -26,7 +32,9 @@ def load_excel_to_dataframe(filepath: str, sheet_name: Any = 0, header: Any = 0)
     return pd.DataFrame()
 
 
+@lru_cache(maxsize=None)
 def get_default_credentials() -> tuple:
+    import google.auth
     return google.auth.default()
 
 
@@ -48,6 +56,7 @@ def save_file_locally(df: pd.DataFrame, prefix: str = None) -> str:
 
 
 def save_to_excel(dfs: List[pd.DataFrame], sheet_names: List[str], filename: str) -> None:
+    import pandas as pd
     if len(dfs):
         with pd.ExcelWriter(filename) as writer:
             for df, s in zip(dfs, sheet_names):
@@ -55,6 +64,7 @@ def save_to_excel(dfs: List[pd.DataFrame], sheet_names: List[str], filename: str
 
 
 def get_config(project_id: str, collection_id: str, config_id: str) -> dict:
+    from google.cloud import firestore
     # noinspection PyTypeChecker
     db = firestore.Client(project=project_id)
     doc_ref = db.collection(collection_id).document(config_id)